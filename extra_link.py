@@ -6,6 +6,7 @@ import sys
 import yaml
 
 from utils.subscription import *
+from utils.render import *
 
 
 def link_to_servers(link: str, ua: str | None = None) -> list[ServerInfo] | None:
@@ -15,28 +16,23 @@ def link_to_servers(link: str, ua: str | None = None) -> list[ServerInfo] | None
     return subscription_to_servers(link, None, ua)
 
 
-def generate_proxy_providers(server_confs: list[ServerInfo], path: str):
-    configs = {"proxies": []}
+def generate_proxy_providers(
+    server_confs: list[ServerInfo], path: str, style: str = STYLE_BLOCK
+):
+    ClashProviderRenderer(style).write(server_confs, path)
 
-    for server_conf in server_confs:
-        configs["proxies"].append(server_conf_2_dict(server_conf))
 
-    try:
-        with open(path, "w") as f:
-            yaml.dump(configs, f)
-    except Exception as e:
-        print(e, file=sys.stderr)
-        raise InternalError("Can not dump yaml to path: '" + path + "'.")
-
-
-def modify_main_config(main_conf_path: str, provider_conf_path: str, name: str):
+def modify_main_config(
+    main_conf_path: str, provider_conf_path: str, name: str, style: str = STYLE_BLOCK
+):
     if not main_conf_path:
         raise InternalError("no main config path passed.")
     _, provider_file_name = os.path.split(provider_conf_path)
     clash_config: dict|None = None
     try:
-        with open(main_conf_path, "r") as f:
-            clash_config = yaml.safe_load(f)
+        with open(main_conf_path, "r", encoding="utf-8") as f:
+            # anchors load as shared objects, unshare them before editing
+            clash_config = unshare(yaml.safe_load(f))
     except Exception as e:
         print(e, file=sys.stderr)
         raise InternalError("Can not load yaml from path: '" + main_conf_path + "'.")
@@ -77,8 +73,8 @@ def modify_main_config(main_conf_path: str, provider_conf_path: str, name: str):
             break
 
     try:
-        with open(main_conf_path, "w") as f:
-            yaml.dump(clash_config, f)
+        with open(main_conf_path, "w", encoding="utf-8") as f:
+            dump_document(clash_config, f, style)
     except Exception as e:
         print(e, file=sys.stderr)
         raise InternalError("Can not dump yaml to path: '" + main_conf_path + "'.")
@@ -91,8 +87,9 @@ def main():
     name = None
     server_confs = None
     ua = None
+    style = STYLE_BLOCK
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "l:f:m:n:u:")
+        opts, args = getopt.getopt(sys.argv[1:], "l:f:m:n:u:c:")
         for opt, arg in opts:
             if opt == "-f":
                 path = arg
@@ -104,16 +101,21 @@ def main():
                 name = arg
             elif opt == "-u":
                 ua = arg
+            elif opt == "-c":  # output style: block, compact or json
+                if arg not in STYLES:
+                    raise getopt.GetoptError("unknown output style " + arg)
+                style = arg
         if link:
             server_confs = link_to_servers(link, ua)
         if server_confs is not None and path is not None:
-            generate_proxy_providers(server_confs, path)
+            generate_proxy_providers(server_confs, path, style)
         
         if main_conf_path is not None and path is not None and name is not None:
-            modify_main_config(main_conf_path, path, name)
+            modify_main_config(main_conf_path, path, name, style)
     except getopt.GetoptError:
         print(
-            "使用参数 -f /path/to/proxy-providers.yaml -m /path/to/config.yaml -n provider-name -l https://location.subscription/url",
+            "使用参数 -f /path/to/proxy-providers.yaml -m /path/to/config.yaml -n provider-name -l https://location.subscription/url\n"
+            "  -u user-agent  -c block|compact|json 输出格式",
             file=sys.stderr,
         )
     except InternalError as e:
@@ -3,22 +3,40 @@
 import os.path
 import sys
 import getopt
-import yaml
 from utils.subscription import *
+from utils.resolve import resolve_servers
+from utils.render import *
+from utils.controller import *
+from utils.history import LatencyHistory, server_identity
+from utils.hedge import MirrorStats, fetch_from_mirrors
 
 SUBSCRIPTION_URL = (
     "https://jjsubmarines.com/members/getsub.php?service={0}&id={1}&usedomains=1"
 )
 
+# other hosts serving the same getsub.php (usedomains=1), -M overrides
+SUBSCRIPTION_MIRRORS: list[str] = []
+
 
 SERVERS_PRIORITY = [5, 3, 1, 2, 4, 801]
 
 
-def grab_subscriptions(service_id: str, uuid: str, fallback: None | str, path: str):
+def grab_subscriptions(
+    service_id: str,
+    uuid: str,
+    fallback: None | str,
+    path: str,
+    mirrors: list[str] | None = None,
+):
     url = SUBSCRIPTION_URL.format(service_id, uuid)
     cache_file = os.path.join(os.path.dirname(path), "cache.txt")
+    mirrors = SUBSCRIPTION_MIRRORS if mirrors is None else mirrors
+    fetch = None
+    if mirrors:
+        stats = MirrorStats(os.path.join(os.path.dirname(path), "mirrors.json"))
+        fetch = lambda: fetch_from_mirrors(url, mirrors, None, stats)
     try:
-        result = subscription_to_servers(url, cache_file)
+        result = subscription_to_servers(url, cache_file, None, fetch)
     except InternalError as e:
         print("无法读取订阅链接，尝试使用上次缓存……", file=sys.stderr)
         try:
@@ -34,16 +52,23 @@ def grab_subscriptions(service_id: str, uuid: str, fallback: None | str, path: s
     return result
 
 
-def generate_clash_config(
-    proxies: list, path: str, listen: int, allow_len: bool, support_meta: bool, tun: bool
-):
+def build_clash_config(
+    proxies: list,
+    listen: int,
+    allow_len: bool,
+    support_meta: bool,
+    tun: bool,
+    hosts: dict[str, str] | None = None,
+    delays: dict[str, int | None] | None = None,
+    scores: dict[str, float] | None = None,
+) -> dict:
     clash_config = {
         "allow-lan": allow_len,
         "port": listen,
         "socks-port": listen + 1,
         "mode": "rule",
         "log-level": "warning",
-        "external-controller": "127.0.0.1:9090",
+        "external-controller": CONTROLLER,
         "proxies": [
             {
                 "name": "direct-v6",
@@ -67,6 +92,9 @@ def generate_clash_config(
         "rules": ["MATCH,manual"],
     }
 
+    if hosts:
+        clash_config["hosts"] = hosts
+
     if support_meta:
         if tun:
             clash_config["dns"] = {
@@ -154,30 +182,96 @@ def generate_clash_config(
         clash_config["proxies"].append(clash_proxy)
         clash_config["proxy-groups"][0]["proxies"].append(proxy.tag)
 
-        def proxy_sort_cmp(s: str) -> int:
-            try:
-                sid = int(s.split("@")[1].split(".")[0].split("s")[1])
-                return SERVERS_PRIORITY.index(sid)
-            except ValueError:
-                return 99
-            except KeyError:
-                return 99
-            except Exception:
-                return 99
-
-        clash_config["proxy-groups"][0]["proxies"].sort(
-            reverse=False, key=proxy_sort_cmp
+    def proxy_sort_cmp(s: str) -> int:
+        try:
+            sid = int(s.split("@")[1].split(".")[0].split("s")[1])
+            return SERVERS_PRIORITY.index(sid)
+        except ValueError:
+            return 99
+        except KeyError:
+            return 99
+        except Exception:
+            return 99
+
+    # nodes with latency history first, best score first, then the ones never
+    # measured by the static priority, nodes that never succeeded last;
+    # without a history the latest delays stand in for the scores
+    if not scores:
+        scores = {n: d for n, d in (delays or {}).items() if d is not None}
+
+    def proxy_sort_key(s: str) -> tuple:
+        if s not in scores:
+            return 1, 0, proxy_sort_cmp(s)
+        if scores[s] == float("inf"):
+            return 2, 0, proxy_sort_cmp(s)
+        return 0, scores[s], proxy_sort_cmp(s)
+
+    clash_config["proxy-groups"][0]["proxies"].sort(
+        reverse=False, key=proxy_sort_key
+    )
+
+    if delays:
+        clash_config["proxy-groups"][0]["proxies"] = prune_timeouts(
+            clash_config["proxy-groups"][0]["proxies"], delays
+        )
+
+    return clash_config
+
+
+class ClashConfigRenderer(Renderer):
+    def __init__(
+        self,
+        listen: int,
+        allow_len: bool,
+        support_meta: bool,
+        tun: bool,
+        hosts: dict[str, str] | None = None,
+        delays: dict[str, int | None] | None = None,
+        scores: dict[str, float] | None = None,
+        style: str = STYLE_BLOCK,
+    ):
+        super().__init__(style)
+        self.listen = listen
+        self.allow_len = allow_len
+        self.support_meta = support_meta
+        self.tun = tun
+        self.hosts = hosts
+        self.delays = delays
+        self.scores = scores
+
+    def render(self, server_confs: list[ServerInfo]) -> dict:
+        return build_clash_config(
+            server_confs,
+            self.listen,
+            self.allow_len,
+            self.support_meta,
+            self.tun,
+            self.hosts,
+            self.delays,
+            self.scores,
         )
 
+
+def generate_clash_config(
+    proxies: list,
+    path: str,
+    listen: int,
+    allow_len: bool,
+    support_meta: bool,
+    tun: bool,
+    hosts: dict[str, str] | None = None,
+    delays: dict[str, int | None] | None = None,
+    scores: dict[str, float] | None = None,
+    style: str = STYLE_BLOCK,
+):
+    renderer = ClashConfigRenderer(
+        listen, allow_len, support_meta, tun, hosts, delays, scores, style
+    )
     if not path:
+        renderer.render(proxies)
         return  # dry run ?
 
-    try:
-        with open(path, "w") as f:
-            yaml.dump(clash_config, f)
-    except Exception as e:
-        print(e, file=sys.stderr)
-        raise InternalError("Can not dump yaml to path: '" + path + "'.")
+    renderer.write(proxies, path)
 
 
 def main():
@@ -189,8 +283,15 @@ def main():
     fallback = None
     support_meta = False
     tun = False
+    resolve = False
+    pin = False
+    provider_path = None
+    singbox_path = None
+    measure = False
+    mirrors = None
+    style = STYLE_BLOCK
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "mnf:p:s:u:b:")
+        opts, args = getopt.getopt(sys.argv[1:], "mnrRdf:p:s:u:b:o:j:M:c:")
         for opt, arg in opts:
             if opt == "-f":
                 path = arg
@@ -208,12 +309,100 @@ def main():
                 support_meta = True
             elif opt == "-t":
                 tun = True
+            elif opt == "-r":  # pre-resolve hosts
+                resolve = True
+            elif opt == "-R":  # pre-resolve and pin ip
+                resolve = True
+                pin = True
+            elif opt == "-o":  # bare proxy provider
+                provider_path = arg
+            elif opt == "-j":  # sing-box outbounds
+                singbox_path = arg
+            elif opt == "-d":  # measure delays through external-controller
+                measure = True
+            elif opt == "-M":  # subscription mirror hosts, comma separated
+                mirrors = [m.strip() for m in arg.split(",") if m.strip()]
+            elif opt == "-c":  # output style: block, compact or json
+                if arg not in STYLES:
+                    raise getopt.GetoptError("unknown output style " + arg)
+                style = arg
+
+        delays = None
+        measured = None
+        if measure:
+            delay_file = os.path.join(os.path.dirname(path), "delay.json")
+            try:
+                measured = measure_delays(Controller(CONTROLLER))
+            except InternalError as e:
+                print(e.message, file=sys.stderr)
+                print("无法从 external-controller 测速，尝试使用上次结果……", file=sys.stderr)
+                delays = load_delays(delay_file)
+            else:
+                delays = measured
+                try:
+                    save_delays(delay_file, delays)
+                except InternalError as e:
+                    print(e.message, file=sys.stderr)
+
+        server_confs = grab_subscriptions(service, uuid, fallback, path, mirrors)
+        # before pinning, so history follows the domain rather than its ip
+        identities = {s.tag: server_identity(s) for s in server_confs}
+        hosts = None
+        if resolve:
+            server_confs, hosts = resolve_servers(server_confs, pin)
+
+        scores = None
+        history_file = os.path.join(os.path.dirname(path), "history.sqlite")
+        if measure or os.path.exists(history_file):
+            try:
+                with LatencyHistory(history_file) as history:
+                    if measured:
+                        history.record(
+                            {
+                                identities[name]: delay
+                                for name, delay in measured.items()
+                                if name in identities
+                            }
+                        )
+                    node_scores = history.scores(list(identities.values()))
+                scores = {
+                    tag: node_scores[identity]
+                    for tag, identity in identities.items()
+                    if identity in node_scores
+                }
+            except InternalError as e:
+                print(e.message, file=sys.stderr)
 
-        server_confs = grab_subscriptions(service, uuid, fallback, path)
-        generate_clash_config(server_confs, path, listen, allow_lan, support_meta, tun)
+        targets = []
+        if path:
+            targets.append(
+                (
+                    ClashConfigRenderer(
+                        listen,
+                        allow_lan,
+                        support_meta,
+                        tun,
+                        hosts,
+                        delays,
+                        scores,
+                        style,
+                    ),
+                    path,
+                )
+            )
+        if provider_path:
+            targets.append((ClashProviderRenderer(style), provider_path))
+        if singbox_path:
+            targets.append((SingBoxRenderer(style), singbox_path))
+        render_targets(server_confs, targets)
     except getopt.GetoptError:
         print(
-            "使用参数 -f /path/to/clash_config.yaml -p 1082 -s service_id -u uuid",
+            "使用参数 -f /path/to/clash_config.yaml -p 1082 -s service_id -u uuid\n"
+            "  -b fallback_uri  -m 启用 meta 特性  -n 允许局域网连接\n"
+            "  -r 预解析节点域名写入 hosts  -R 预解析并固定节点 IP\n"
+            "  -o /path/to/provider.yaml  -j /path/to/sing-box.json\n"
+            "  -d 通过 external-controller 测速排序  -M mirror1,mirror2\n"
+            "  -c block|compact|json 输出格式",
             file=sys.stderr,
         )
     except InternalError as e:
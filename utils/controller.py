@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+import sys
+import json
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from utils.subscription import InternalError
+from utils.singleflight import write_atomic
+
+CONTROLLER = "127.0.0.1:9090"
+DELAY_URL = "https://cp.cloudflare.com/generate_204"
+DELAY_TIMEOUT = 5000  # ms
+DELAY_WORKERS = 8
+DELAY_MAX_AGE = 900  # seconds a saved delay.json is still trusted
+TIMEOUT_STATUS = (408, 504)  # what mihomo answers for a delay test that timed out
+
+
+class Controller:
+    """Thin client of the clash external-controller delay api."""
+
+    def __init__(self, address: str = CONTROLLER, secret: str | None = None):
+        if not address.startswith("http://") and not address.startswith("https://"):
+            address = "http://" + address
+        self.base = address.rstrip("/")
+        self.headers = {"Authorization": "Bearer " + secret} if secret else {}
+
+    def _get(self, path: str, params: dict | None = None, timeout: float = 10):
+        try:
+            return requests.get(
+                self.base + path,
+                params=params,
+                headers=self.headers,
+                proxies={"http": "", "https": ""},
+                timeout=timeout,
+            )
+        except Exception as e:
+            raise InternalError("can not reach controller " + self.base + ", " + str(e))
+
+    def _json(self, resp) -> dict:
+        try:
+            body = resp.json()
+        except ValueError as e:
+            raise InternalError("controller " + self.base + " returns no json, " + str(e))
+        if not isinstance(body, dict):
+            raise InternalError("controller " + self.base + " returns unexpected json.")
+        return body
+
+    def group_members(self, group: str) -> list[str]:
+        resp = self._get("/proxies/" + quote(group, safe=""))
+        if not resp.ok:
+            raise InternalError(f"controller has no group '{group}'. \n {resp.status_code}")
+        return self._json(resp).get("all", [])
+
+    def group_delay(self, group: str, url: str, timeout: int) -> dict[str, int]:
+        """Delays of every member that answered, timeouts are left out."""
+        resp = self._get(
+            "/group/" + quote(group, safe="") + "/delay",
+            {"url": url, "timeout": timeout},
+            timeout / 1000 + 10,
+        )
+        if not resp.ok:
+            return {}
+        return {
+            k: v for k, v in self._json(resp).items() if isinstance(v, int) and v > 0
+        }
+
+    def proxy_delay(self, name: str, url: str, timeout: int) -> int | None:
+        resp = self._get(
+            "/proxies/" + quote(name, safe="") + "/delay",
+            {"url": url, "timeout": timeout},
+            timeout / 1000 + 5,
+        )
+        if resp.status_code in TIMEOUT_STATUS:
+            return None
+        if not resp.ok:
+            raise InternalError(
+                f"controller can not test '{name}'. \n {resp.status_code}"
+            )
+        delay = self._json(resp).get("delay", 0)
+        return delay if isinstance(delay, int) and delay > 0 else None
+
+
+def measure_delays(
+    controller: Controller,
+    group: str = "jms-available",
+    url: str = DELAY_URL,
+    timeout: int = DELAY_TIMEOUT,
+    workers: int = DELAY_WORKERS,
+) -> dict[str, int | None]:
+    """
+    Probe the whole group in one call, then re-probe the members the group
+    call left out one by one (at most `workers` at a time). `None` means the
+    node timed out twice; members the controller gave a broken answer for
+    are left out.
+    """
+    members = controller.group_members(group)
+    result: dict[str, int | None] = dict.fromkeys(members)
+    try:
+        group_delays = controller.group_delay(group, url, timeout)
+    except InternalError as e:
+        print(e.message, file=sys.stderr)
+        group_delays = {}
+    result.update((k, v) for k, v in group_delays.items() if k in result)
+
+    missing = [name for name, delay in result.items() if delay is None]
+    if missing:
+
+        def probe(name: str) -> int | None | InternalError:
+            try:
+                return controller.proxy_delay(name, url, timeout)
+            except InternalError as e:
+                print(e.message, file=sys.stderr)
+                return e
+
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(missing)))) as pool:
+            for name, delay in zip(missing, pool.map(probe, missing)):
+                if isinstance(delay, InternalError):
+                    del result[name]  # not measured, not a timeout either
+                else:
+                    result[name] = delay
+
+    return result
+
+
+def save_delays(path: str, delays: dict[str, int | None]):
+    try:
+        write_atomic(
+            path, json.dumps({"ts": time.time(), "delays": delays}, ensure_ascii=False)
+        )
+    except OSError as e:
+        raise InternalError("can not write delay file " + path + ", " + str(e))
+
+
+def load_delays(path: str, max_age: float = DELAY_MAX_AGE) -> dict[str, int | None]:
+    """Delays saved within `max_age` seconds, older ones say nothing of now."""
+    try:
+        with open(path, mode="r", encoding="utf-8") as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(saved, dict) or not isinstance(saved.get("delays"), dict):
+        return {}
+    ts = saved.get("ts")
+    if not isinstance(ts, (int, float)) or time.time() - ts > max_age:
+        return {}
+    return saved["delays"]
+
+
+def prune_timeouts(names: list[str], delays: dict[str, int | None]) -> list[str]:
+    """Drop nodes that timed out, unless that would leave nothing."""
+    alive = [n for n in names if n not in delays or delays[n] is not None]
+    return alive if alive else list(names)
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+import sys
+import json
+import time
+import queue
+import threading
+from typing import Callable
+from urllib.parse import urlsplit, urlunsplit
+
+from utils.subscription import InternalError, base64decode, fetch_subscription
+from utils.singleflight import write_atomic
+
+HEDGE_PERCENTILE = 0.9
+HEDGE_DELAY = 2.0  # seconds, until a mirror has enough samples
+MIN_SAMPLES = 5
+MAX_SAMPLES = 20
+
+
+def mirror_urls(url: str, mirrors: list[str]) -> list[str]:
+    """The same request against every mirror host, `url`'s own host first."""
+    parts = urlsplit(url)
+    result = [url]
+    for mirror in mirrors:
+        mirror_url = urlunsplit(parts._replace(netloc=mirror))
+        if mirror_url not in result:
+            result.append(mirror_url)
+    return result
+
+
+class MirrorStats:
+    """Recent fetch latencies per mirror host, None marks a failed fetch."""
+
+    def __init__(self, path: str | None = None):
+        self.path = path
+        self.samples: dict[str, list[float | None]] = {}
+        if path is None:
+            return
+        try:
+            with open(path, mode="r", encoding="utf-8") as f:
+                samples = json.load(f)
+        except (OSError, ValueError):
+            return
+        if not isinstance(samples, dict):
+            return
+        # keep only what record() could have written, drop hand edits
+        for host, values in samples.items():
+            if isinstance(values, list) and all(
+                v is None or (isinstance(v, (int, float)) and not isinstance(v, bool))
+                for v in values
+            ):
+                self.samples[host] = values[-MAX_SAMPLES:]
+
+    def save(self):
+        if self.path is None:
+            return
+        try:
+            write_atomic(self.path, json.dumps(self.samples))
+        except OSError as e:
+            print("can not save mirror stats " + self.path + ", " + str(e), file=sys.stderr)
+
+    def record(self, url: str, latency: float | None):
+        host = urlsplit(url).netloc
+        samples = self.samples.setdefault(host, [])
+        samples.append(latency)
+        del samples[:-MAX_SAMPLES]
+
+    def _latencies(self, url: str) -> list[float]:
+        return sorted(s for s in self.samples.get(urlsplit(url).netloc, []) if s is not None)
+
+    def percentile(self, url: str, p: float = HEDGE_PERCENTILE) -> float:
+        latencies = self._latencies(url)
+        if len(latencies) < MIN_SAMPLES:
+            return HEDGE_DELAY
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+    def order(self, urls: list[str]) -> list[str]:
+        """
+        Fastest mirror first: median latency over success ratio of the last
+        MIN_SAMPLES fetches, so a mirror that slowed down drops quickly.
+        Unseen mirrors last.
+        """
+
+        def score(url: str) -> float:
+            samples = self.samples.get(urlsplit(url).netloc, [])[-MIN_SAMPLES:]
+            latencies = sorted(s for s in samples if s is not None)
+            if not latencies:
+                return float("inf")
+            return latencies[len(latencies) // 2] * len(samples) / len(latencies)
+
+        return sorted(urls, key=score)
+
+
+def hedged_fetch(
+    urls: list[str],
+    fetch: Callable[[str, threading.Event], str],
+    stats: MirrorStats,
+    percentile: float = HEDGE_PERCENTILE,
+) -> str:
+    """
+    Ask the fastest known mirror first; whenever nothing answered within its
+    `percentile` latency (or a request failed) fire the next mirror too. The
+    first body `fetch` accepts wins, the others are told to stop through the
+    event passed to `fetch`. Requests run on daemon threads so a loser still
+    blocked in a socket read does not keep the process alive.
+    """
+    order = stats.order(urls)
+    cancel = threading.Event()
+    results = queue.Queue()
+    pending: dict[str, float] = dict()
+    last_error = None
+    winner_latency = None
+
+    def run(url: str):
+        try:
+            results.put((url, fetch(url, cancel), None))
+        except InternalError as e:
+            results.put((url, None, e))
+        except Exception as e:
+            results.put((url, None, InternalError(str(e))))
+
+    def launch() -> str:
+        url = order.pop(0)
+        pending[url] = time.monotonic()
+        threading.Thread(target=run, args=(url,), daemon=True).start()
+        return url
+
+    try:
+        hedge_delay = stats.percentile(launch(), percentile)
+        while pending:
+            try:
+                url, text, error = results.get(timeout=hedge_delay if order else None)
+            except queue.Empty:
+                launch()
+                continue
+            start = pending.pop(url)
+            if error is not None:
+                stats.record(url, None)
+                last_error = error
+                print(url + ": " + error.message, file=sys.stderr)
+                if order:
+                    launch()
+                continue
+            winner_latency = time.monotonic() - start
+            stats.record(url, winner_latency)
+            return text
+    finally:
+        cancel.set()
+        # a loser that ran longer than the winner took is at least that slow;
+        # record that lower bound so a primary gone slow loses its place
+        now = time.monotonic()
+        for url, start in pending.items():
+            if winner_latency is not None and now - start > winner_latency:
+                stats.record(url, now - start)
+        stats.save()
+
+    raise InternalError(
+        "all subscription mirrors failed. "
+        + (last_error.message if last_error is not None else "")
+    )
+
+
+def fetch_from_mirrors(
+    url: str, mirrors: list[str], ua: str | None, stats: MirrorStats
+) -> str:
+    def fetch(mirror_url: str, cancel: threading.Event) -> str:
+        text = fetch_subscription(mirror_url, ua, cancel)
+        try:
+            decoded = base64decode(text).decode("utf-8", "strict")
+        except UnicodeDecodeError:
+            decoded = ""
+        if "://" not in decoded:
+            raise InternalError("'" + mirror_url + "' returns no subscription.")
+        return text
+
+    return hedged_fetch(mirror_urls(url, mirrors), fetch, stats)
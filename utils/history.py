@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import time
+import sqlite3
+
+from utils.subscription import InternalError, ServerInfo
+
+EWMA_ALPHA = 0.3
+MAX_AGE = 14 * 24 * 3600
+MAX_ROWS = 50000
+MIN_SUCCESS = 0.05
+
+
+def server_identity(server_conf: ServerInfo) -> str:
+    """Tags get renamed by the provider, the endpoint does not."""
+    return f"{server_conf.protocol}://{server_conf.host}:{server_conf.port}"
+
+
+class LatencyHistory:
+    """
+    Per-node latency / failure samples in sqlite. A node scores by its EWMA
+    latency divided by its EWMA success rate, lower is better.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        alpha: float = EWMA_ALPHA,
+        max_age: float = MAX_AGE,
+        max_rows: int = MAX_ROWS,
+    ):
+        self.alpha = alpha
+        self.max_age = max_age
+        self.max_rows = max_rows
+        try:
+            self.db = sqlite3.connect(path)
+            self.db.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS samples (
+                    node TEXT NOT NULL,
+                    ts REAL NOT NULL,
+                    latency REAL,
+                    ok INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS samples_node_ts ON samples (node, ts);
+                CREATE INDEX IF NOT EXISTS samples_ts ON samples (ts);
+                """
+            )
+        except sqlite3.Error as e:
+            raise InternalError("can not open history database " + path + ", " + str(e))
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def record(self, samples: dict[str, int | None], ts: float | None = None):
+        """`samples` maps node identity to latency in ms, None for a failure."""
+        ts = time.time() if ts is None else ts
+        try:
+            with self.db:
+                self.db.executemany(
+                    "INSERT INTO samples (node, ts, latency, ok) VALUES (?, ?, ?, ?)",
+                    [
+                        (node, ts, latency, 0 if latency is None else 1)
+                        for node, latency in samples.items()
+                    ],
+                )
+        except sqlite3.Error as e:
+            raise InternalError("can not record latency history, " + str(e))
+        self.prune(ts)
+
+    def prune(self, now: float | None = None):
+        now = time.time() if now is None else now
+        try:
+            with self.db:
+                self.db.execute("DELETE FROM samples WHERE ts < ?", (now - self.max_age,))
+                self.db.execute(
+                    "DELETE FROM samples WHERE rowid IN "
+                    "(SELECT rowid FROM samples ORDER BY ts DESC LIMIT -1 OFFSET ?)",
+                    (self.max_rows,),
+                )
+        except sqlite3.Error as e:
+            raise InternalError("can not prune latency history, " + str(e))
+
+    def score(self, node: str) -> float | None:
+        """None when the node has never been sampled."""
+        latency = None
+        success = None
+        try:
+            samples = self.db.execute(
+                "SELECT latency, ok FROM samples WHERE node = ? ORDER BY ts", (node,)
+            ).fetchall()
+        except sqlite3.Error as e:
+            raise InternalError("can not read latency history, " + str(e))
+        for sample_latency, ok in samples:
+            success = ok if success is None else success + self.alpha * (ok - success)
+            if ok:
+                latency = (
+                    sample_latency
+                    if latency is None
+                    else latency + self.alpha * (sample_latency - latency)
+                )
+        if success is None:
+            return None
+        if latency is None:
+            return float("inf")
+        return latency / max(success, MIN_SUCCESS)
+
+    def scores(self, nodes: list[str]) -> dict[str, float]:
+        result = dict()
+        for node in nodes:
+            score = self.score(node)
+            if score is not None:
+                result[node] = score
+        return result
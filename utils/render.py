@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+import sys
+import json
+import yaml
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.subscription import (
+    InternalError,
+    ServerInfo,
+    server_conf_2_dict,
+    server_conf_2_singbox,
+)
+
+
+STYLE_BLOCK = "block"
+STYLE_COMPACT = "compact"
+STYLE_JSON = "json"
+STYLES = (STYLE_BLOCK, STYLE_COMPACT, STYLE_JSON)
+
+
+def dedupe(node, seen: dict | None = None):
+    """
+    Copy of `node` where equal mappings are the same object, so the yaml
+    dumper writes them once as an anchor and aliases the rest. Sequences are
+    left alone: loaders hand aliases back as one shared object and lists
+    like group members get appended to in place.
+    """
+    seen = {} if seen is None else seen
+    if isinstance(node, list):
+        return [dedupe(v, seen) for v in node]
+    if not isinstance(node, dict):
+        return node
+    node = {k: dedupe(v, seen) for k, v in node.items()}
+    if not node:
+        return node
+    key = json.dumps(node, sort_keys=True, default=str)
+    return seen.setdefault(key, node)
+
+
+def unshare(node):
+    """Copy without keeping aliases, unlike copy.deepcopy's memo."""
+    if isinstance(node, dict):
+        return {k: unshare(v) for k, v in node.items()}
+    if isinstance(node, list):
+        return [unshare(v) for v in node]
+    return node
+
+
+def dump_document(document: dict, f, style: str = STYLE_BLOCK):
+    """
+    block: plain yaml.dump. compact: repeated mappings become anchors and
+    leaf collections flow style. json: minified json, which is valid yaml.
+    """
+    if style == STYLE_JSON:
+        json.dump(document, f, ensure_ascii=False, separators=(",", ":"))
+    elif style == STYLE_COMPACT:
+        yaml.dump(
+            dedupe(document),
+            f,
+            default_flow_style=None,
+            allow_unicode=True,
+            width=float("inf"),
+        )
+    else:
+        yaml.dump(document, f)
+
+
+class Renderer(ABC):
+    """One output target: turns parsed servers into a document and writes it."""
+
+    def __init__(self, style: str = STYLE_BLOCK):
+        self.style = style
+
+    @abstractmethod
+    def render(self, server_confs: list[ServerInfo]) -> dict:
+        pass
+
+    def dump(self, document: dict, f):
+        dump_document(document, f, self.style)
+
+    def write(self, server_confs: list[ServerInfo], path: str):
+        document = self.render(server_confs)
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                self.dump(document, f)
+        except Exception as e:
+            print(e, file=sys.stderr)
+            raise InternalError("Can not dump to path: '" + path + "'.")
+
+
+class ClashProviderRenderer(Renderer):
+    def render(self, server_confs: list[ServerInfo]) -> dict:
+        return {"proxies": [server_conf_2_dict(s) for s in server_confs]}
+
+
+class SingBoxRenderer(Renderer):
+    def render(self, server_confs: list[ServerInfo]) -> dict:
+        return {"outbounds": [server_conf_2_singbox(s) for s in server_confs]}
+
+    def dump(self, document: dict, f):
+        if self.style == STYLE_JSON:
+            dump_document(document, f, STYLE_JSON)
+        else:
+            json.dump(document, f, ensure_ascii=False, indent=2)
+
+
+def render_targets(
+    server_confs: list[ServerInfo], targets: list[tuple[Renderer, str]]
+):
+    """Write every (renderer, path) target in parallel from the same servers."""
+    if not targets:
+        return
+
+    with ThreadPoolExecutor(max_workers=len(targets)) as pool:
+        futures = [
+            pool.submit(renderer.write, server_confs, path)
+            for renderer, path in targets
+        ]
+
+    errors = [f.exception() for f in futures if f.exception() is not None]
+    for e in errors[1:]:
+        print(e.message if isinstance(e, InternalError) else e, file=sys.stderr)
+    if errors:
+        raise errors[0]
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+import sys
+import copy
+import time
+import socket
+import ipaddress
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from utils.subscription import ServerInfo
+
+DEFAULT_TTL = 300
+DEFAULT_WORKERS = 16
+
+
+def is_ip_address(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+
+
+def is_public_address(ip: str) -> bool:
+    """
+    False for clash's fake-ip range (198.18.0.0/15) and every other
+    non-global range: when the tool runs under a clash tun with dns-hijack,
+    getaddrinfo answers with fake ips that must never be pinned.
+    """
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    return address.is_global and not address.is_multicast
+
+
+def system_resolver(host: str) -> str | None:
+    try:
+        infos = socket.getaddrinfo(host, None, socket.AF_INET, socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError, OSError) as e:
+        print(f"can not resolve '{host}': {e}", file=sys.stderr)
+        return None
+    for info in infos:
+        if is_public_address(info[4][0]):
+            return info[4][0]
+    if infos:
+        print(f"'{host}' only resolves to reserved addresses.", file=sys.stderr)
+    return None
+
+
+class ResolveCache:
+    """host -> (ip, expire time), failures are cached as well so a dead
+    domain is not retried for every node sharing it. Kept in memory only,
+    so it lasts for one run of the tool."""
+
+    def __init__(self, ttl: float = DEFAULT_TTL, clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self._entries: dict[str, tuple[str | None, float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, host: str) -> tuple[bool, str | None]:
+        with self._lock:
+            entry = self._entries.get(host)
+            if entry is None:
+                return False, None
+            ip, expire = entry
+            if expire < self.clock():
+                del self._entries[host]
+                return False, None
+            return True, ip
+
+    def put(self, host: str, ip: str | None):
+        with self._lock:
+            self._entries[host] = (ip, self.clock() + self.ttl)
+
+
+_default_cache = ResolveCache()
+
+
+def resolve_hosts(
+    hosts: list[str],
+    resolver: Callable[[str], str | None] | None = None,
+    cache: ResolveCache | None = None,
+    workers: int = DEFAULT_WORKERS,
+) -> dict[str, str | None]:
+    resolver = resolver or system_resolver
+    cache = cache or _default_cache
+    result: dict[str, str | None] = {}
+    pending: list[str] = []
+
+    for host in dict.fromkeys(hosts):
+        if is_ip_address(host):
+            result[host] = host
+            continue
+        hit, ip = cache.get(host)
+        if hit:
+            result[host] = ip
+        else:
+            pending.append(host)
+
+    def safe_resolve(host: str) -> str | None:
+        try:
+            ip = resolver(host)
+        except Exception as e:
+            print(f"can not resolve '{host}': {e}", file=sys.stderr)
+            return None
+        if ip is not None and not is_public_address(ip):
+            print(f"'{host}' resolves to reserved address {ip}.", file=sys.stderr)
+            return None
+        return ip
+
+    if pending:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(pending)))) as pool:
+            for host, ip in zip(pending, pool.map(safe_resolve, pending)):
+                cache.put(host, ip)
+                result[host] = ip
+
+    return result
+
+
+def can_pin(server_conf: ServerInfo) -> bool:
+    """
+    False when the domain is also the HTTP Host header: ws/http transports
+    and obfs without obfs-host. Clash falls back to `server` for it, so a
+    pinned ip would break CDN-fronted nodes.
+    """
+    if server_conf.net in ("ws", "http", "h2", "httpupgrade"):
+        return False
+    if server_conf.plugin == "obfs" and not (server_conf.plugin_opts or {}).get("host"):
+        return False
+    return True
+
+
+def resolve_servers(
+    server_confs: list[ServerInfo],
+    pin: bool = False,
+    resolver: Callable[[str], str | None] | None = None,
+    cache: ResolveCache | None = None,
+    workers: int = DEFAULT_WORKERS,
+) -> tuple[list[ServerInfo], dict[str, str]]:
+    """
+    Resolve every node's host concurrently, drop nodes that do not resolve.
+    Returns the surviving nodes and a clash `hosts` mapping. With `pin`, the
+    returned nodes carry the ip as host and keep the domain as sni; nodes
+    that can not be pinned (see can_pin) stay on their domain in `hosts`.
+    """
+    resolved = resolve_hosts(
+        [s.host for s in server_confs], resolver, cache, workers
+    )
+
+    result: list[ServerInfo] = list()
+    hosts: dict[str, str] = dict()
+    for server_conf in server_confs:
+        ip = resolved.get(server_conf.host)
+        if not ip:
+            print(
+                f"drop '{server_conf.tag}', host '{server_conf.host}' can not be resolved.",
+                file=sys.stderr,
+            )
+            continue
+        if ip == server_conf.host:
+            result.append(server_conf)
+            continue
+        if pin and can_pin(server_conf):
+            server_conf = copy.copy(server_conf)
+            server_conf.sni = server_conf.sni or server_conf.host
+            server_conf.host = ip
+        else:
+            hosts[server_conf.host] = ip
+        result.append(server_conf)
+
+    return result, hosts
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import stat
+import time
+import getpass
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Callable
+
+try:
+    import fcntl
+except ImportError:  # not posix, only in-process coalescing
+    fcntl = None
+
+FRESHNESS = 30
+
+_guard = threading.Lock()
+_thread_locks: dict[str, threading.Lock] = {}
+_results: dict[str, tuple[float, str, list]] = {}
+
+
+def default_lock_dir() -> str:
+    try:
+        user = getpass.getuser()
+    except Exception:  # no USER/LOGNAME and no passwd entry, e.g. containers
+        user = str(os.getuid()) if hasattr(os, "getuid") else "default"
+    return os.path.join(tempfile.gettempdir(), "jms-to-clash-" + user)
+
+
+def write_atomic(path: str, text: str):
+    """Write to a sibling temp file then rename, readers never see a torn file."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, mode="w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def _thread_lock(key: str) -> threading.Lock:
+    with _guard:
+        lock = _thread_locks.get(key)
+        if lock is None:
+            lock = threading.Lock()
+            _thread_locks[key] = lock
+        return lock
+
+
+@contextmanager
+def _file_lock(path: str):
+    if fcntl is None:
+        yield
+        return
+    with open(path, "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _private_dir(path: str) -> bool:
+    """Create `path` 0700 if missing; only trust it when it is our own."""
+    try:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        st = os.lstat(path)
+    except OSError:
+        return False
+    if not stat.S_ISDIR(st.st_mode):
+        return False
+    if hasattr(os, "getuid"):
+        return st.st_uid == os.getuid() and st.st_mode & 0o077 == 0
+    return True
+
+
+def _shared_fetch(
+    key: str,
+    lock_dir: str,
+    fetch: Callable[[], str],
+    parse: Callable[[str], list],
+    freshness: float,
+) -> tuple[str, list]:
+    body_file = os.path.join(lock_dir, key + ".body")
+
+    with _file_lock(os.path.join(lock_dir, key + ".lock")):
+        try:
+            if time.time() - os.path.getmtime(body_file) <= freshness:
+                with open(body_file, mode="r", encoding="utf-8") as f:
+                    text = f.read()
+                return text, parse(text)
+        except OSError:
+            pass
+
+        text = fetch()
+        result = parse(text)
+        try:
+            write_atomic(body_file, text)
+        except OSError:
+            pass
+        return text, result
+
+
+def coalesced_fetch(
+    url: str,
+    fetch: Callable[[], str],
+    parse: Callable[[str], list],
+    freshness: float = FRESHNESS,
+    lock_dir: str | None = None,
+    ua: str | None = None,
+) -> tuple[str, list]:
+    """
+    Single-flight `fetch` keyed by url and user agent (providers answer each
+    client with its own format). Threads of this process wait on an
+    in-process lock, other processes wait on a file lock; whoever comes after
+    the in-flight fetch reuses its body (and parsed result) while it is
+    younger than `freshness` seconds instead of fetching again.
+    """
+    key = hashlib.sha1((url + "\0" + (ua or "")).encode("utf-8")).hexdigest()
+    with _thread_lock(key):
+        memo = _results.get(key)
+        if memo is not None and time.time() - memo[0] <= freshness:
+            return memo[1], list(memo[2])
+
+        lock_dir = lock_dir or default_lock_dir()
+        if _private_dir(lock_dir):
+            text, result = _shared_fetch(key, lock_dir, fetch, parse, freshness)
+        else:
+            print(
+                "lock directory " + lock_dir + " is not private, not sharing fetches.",
+                file=sys.stderr,
+            )
+            text = fetch()
+            result = parse(text)
+
+        _results[key] = (time.time(), text, result)
+        return text, list(result)
@@ -3,9 +3,13 @@ import sys
 import json
 import base64
 import time
+import threading
 import requests
+from typing import Callable
 from urllib.parse import unquote
 
+from utils.singleflight import coalesced_fetch, write_atomic
+
 SS = "shadowsocks"
 VMESS = "vmess"
 VLESS = "vless"
@@ -261,17 +265,17 @@ def decode_anytls(server_str: str) -> ServerInfo | None:
     return info
 
 
-def subscription_to_servers(
-    url: str, cache_file: str | None, ua: str | None = None
-) -> list[ServerInfo]:
-    result: list[ServerInfo] = list()
-
+def fetch_subscription(
+    url: str, ua: str | None = None, cancel: threading.Event | None = None
+) -> str:
     max_retries = 10
     retry_count = 0
     last_exception = None
     resp = None
     ua = ua or "curl/8.17.0"
     while retry_count <= max_retries:
+        if cancel is not None and cancel.is_set():
+            raise InternalError("request to '" + url + "' cancelled.")
         try:
             resp = requests.get(
                 url,
@@ -301,7 +305,13 @@ def subscription_to_servers(
     if not resp.ok:
         raise InternalError(f"requests.get's response not ok. \n {resp.status_code}")
 
-    server_confs_bs = base64decode(resp.text)
+    return resp.text
+
+
+def text_to_servers(text: str) -> list[ServerInfo]:
+    result: list[ServerInfo] = list()
+
+    server_confs_bs = base64decode(text)
     try:
         server_confs_str = server_confs_bs.decode("utf-8", "strict")
     except UnicodeDecodeError as e:
@@ -317,10 +327,25 @@ def subscription_to_servers(
         if info is not None:
             result.append(info)
 
+    return result
+
+
+def subscription_to_servers(
+    url: str,
+    cache_file: str | None,
+    ua: str | None = None,
+    fetch: Callable[[], str] | None = None,
+) -> list[ServerInfo]:
+    text, result = coalesced_fetch(
+        url,
+        fetch or (lambda: fetch_subscription(url, ua)),
+        text_to_servers,
+        ua=ua,
+    )
+
     if cache_file is not None:
         try:
-            with open(cache_file, mode="w") as f:
-                f.write(resp.text)
+            write_atomic(cache_file, text)
         except OSError:
             pass
 
@@ -328,30 +353,12 @@ def subscription_to_servers(
 
 
 def cache_to_servers(file: str):
-    result = list()
     try:
         with open(file, mode="r") as f:
             text = f.read()
-            server_confs_bs = base64decode(text)
-            try:
-                server_confs_str = server_confs_bs.decode("utf-8", "strict")
-            except UnicodeDecodeError:
-                raise InternalError(
-                    "subscription b64 decoded result can not decode to string by utf-8"
-                )
-
-            server_confs = server_confs_str.split("\n")
-
-            for server_conf in server_confs:
-                info = uri_to_server(server_conf)
-
-                if info is not None:
-                    result.append(info)
-
-            return result
     except OSError as e:
         raise InternalError("can not open cache file " + file + ", " + str(e))
-    return result
+    return text_to_servers(text)
 
 
 def uri_to_server(uri: str) -> ServerInfo | None:
@@ -458,3 +465,75 @@ def server_conf_2_dict(server_conf: ServerInfo) -> dict[str, str | int | bool |
         if server_conf.client_fingerprint is not None:
             clash_proxy["client-fingerprint"] = server_conf.client_fingerprint
     return clash_proxy
+
+
+def server_conf_2_singbox(server_conf: ServerInfo) -> dict[str, str | int | bool | dict]:
+    outbound = {
+        "type": server_conf.protocol,
+        "tag": server_conf.tag,
+        "server": server_conf.host,
+        "server_port": server_conf.port,
+    }
+    tls = {
+        "enabled": True,
+        "server_name": server_conf.sni or server_conf.host,
+        "insecure": True,
+    }
+    if server_conf.client_fingerprint:
+        tls["utls"] = {"enabled": True, "fingerprint": server_conf.client_fingerprint}
+
+    transport = None
+    if server_conf.net == "grpc":
+        transport = {"type": "grpc"}
+        if server_conf.path:
+            transport["service_name"] = server_conf.path
+    elif server_conf.net == "ws":
+        transport = {"type": "ws"}
+        if server_conf.path:
+            transport["path"] = server_conf.path
+
+    if server_conf.protocol == SS:
+        outbound["method"] = server_conf.algorithm
+        outbound["password"] = server_conf.key
+        if server_conf.plugin == "obfs":
+            outbound["plugin"] = "obfs-local"
+            opts = server_conf.plugin_opts or {}
+            outbound["plugin_opts"] = ";".join(
+                [
+                    k + "=" + opts[v]
+                    for k, v in (("obfs", "mode"), ("obfs-host", "host"), ("path", "path"))
+                    if v in opts
+                ]
+            )
+    elif server_conf.protocol == VMESS:
+        outbound["uuid"] = server_conf.key
+        outbound["security"] = server_conf.algorithm
+        outbound["alter_id"] = server_conf.alter_id
+        if server_conf.tls == "tls":
+            outbound["tls"] = tls
+        if transport is not None:
+            outbound["transport"] = transport
+    elif server_conf.protocol == VLESS:
+        outbound["uuid"] = server_conf.key
+        if server_conf.flow:
+            outbound["flow"] = server_conf.flow
+        if server_conf.tls == "tls":
+            outbound["tls"] = tls
+        if transport is not None:
+            outbound["transport"] = transport
+    elif server_conf.protocol == TROJAN:
+        outbound["password"] = server_conf.key
+        outbound["tls"] = tls
+        if transport is not None:
+            outbound["transport"] = transport
+    elif server_conf.protocol == HY2:
+        outbound["password"] = server_conf.key
+        if server_conf.up is not None:
+            outbound["up_mbps"] = int(server_conf.up)
+        if server_conf.down is not None:
+            outbound["down_mbps"] = int(server_conf.down)
+        outbound["tls"] = tls
+    elif server_conf.protocol == ANYTLS:
+        outbound["password"] = server_conf.key
+        outbound["tls"] = tls
+    return outbound